@@ -1,12 +1,67 @@
 #!/usr/bin/env python
+from __future__ import annotations
+
 import requests
-import csv
-import json 
+from requests.adapters import HTTPAdapter
+import hashlib
+import io
+import json
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import chain
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Matches one "@p1000<kind>" marker in a field annotation. The JSON payload that
+# follows is matched separately, so a malformed payload can't hide the marker.
+_P1000_MARKER_RE = re.compile(r'@p1000(?P<kind>\w+)\s*')
+
+# Fast path for the payload: tolerates one level of nested braces (multiple-choice
+# answers). Translated text with stray or deeper braces defeats this pattern;
+# build_translation_rows falls back to scanning for the block's end instead.
+_P1000_JSON_RE = re.compile(r'\{(?:[^{}]|\{[^{}]*\})*\}')
+
+# Pivoted multiple-choice answer dicts, keyed by the raw JSON text of the
+# @p1000answers block they came from (identical choice lists are common)
+_pivot_cache: dict = {}
+
+# One session for all API calls: connections (and their TLS handshakes) are
+# pooled and reused when multiple projects are processed in a batch
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+# Metadata responses are cached on disk for a day so reruns (common while
+# debugging a migration) skip the API round-trip; --refresh-metadata bypasses
+_METADATA_CACHE_DIR = Path('.cache')
+_METADATA_CACHE_MAX_AGE = 24 * 60 * 60  # seconds
+
+# Fields are parsed across a process pool only for projects at least this big;
+# below it, spawning workers costs more than the parsing itself
+_PARALLEL_FIELD_THRESHOLD = 500
+
 ################################################################
 ################################################################
 
+def _loads(data):
+    '''Decodes a JSON payload (str or bytes), preferring orjson's C decoder when installed.
+    Falls back to the stdlib for payloads orjson rejects (e.g. bare control characters
+    inside strings, which REDCap annotations may contain).
+    '''
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data, strict=False)
+
 def load_secrets(secrets_file_path: str) -> tuple[str, str]:
     '''Returns a 2-tuple of sensitive data located in secrets_file_path: ('api_token', 'url').
     Raises a ValueError if either field in secrets file is empty.
@@ -18,9 +73,10 @@ def load_secrets(secrets_file_path: str) -> tuple[str, str]:
         return (result['old_proj_api_token'], result['old_proj_url'])
     raise ValueError(f"Failed to load {secrets_file_path} - did you fill in your REDCap project's API key and URL?")
 
-def _request_metadata(token: str, url: str, check_cert: bool) -> str:
+def _request_metadata(token: str, url: str, check_cert: bool) -> bytes:
     '''Makes a REDCap API call for a REDCap project's metadata.
-    Returns the text of the API response.
+    Returns the raw bytes of the API response; the JSON parser consumes UTF-8
+    bytes directly, so decoding to str here would just be a wasted O(n) pass.
     Skips certificate checking if 'check_cert' is False.
     '''
     metadata_request = {
@@ -28,20 +84,52 @@ def _request_metadata(token: str, url: str, check_cert: bool) -> str:
         'content': 'metadata',
         'format': 'json'
     }
-    r = requests.post(url, data=metadata_request, verify=check_cert)
+    r = _SESSION.post(url, data=metadata_request, verify=check_cert, timeout=60)
     #print('>>> Metadata request HTTP Status: ' + str(r.status_code))
-    return r.text
+    return r.content
 
-def get_metadata(token: str, url: str, check_cert: bool) -> list[dict]:
+def get_metadata(token: str, url: str, check_cert: bool, refresh: bool = False) -> list[dict]:
     '''Returns a list of dictionaries that contain metadata for a REDCap project's fields.
+    Responses are cached in '_METADATA_CACHE_DIR' for up to a day, keyed by a hash of
+    the project's URL and token; pass 'refresh' as True to force a live API call.
     '''
     if not check_cert:
         print("* Certificate checking is disabled.")
-    raw_metadata_string = _request_metadata(token, url, check_cert)
-    md = json.loads(raw_metadata_string)
-    if type(md) == dict and md['error']:
-        print(f"REDCap API returned an error while fetching metadata: {md['error']}")
-        exit(1)
+
+    cache_key = hashlib.sha256(f"{url}|{token}".encode('utf-8')).hexdigest()[:16]
+    cache_file = _METADATA_CACHE_DIR / f"redcap_{cache_key}.json"
+
+    raw_metadata = None
+    if not refresh:
+        try:
+            if time.time() - cache_file.stat().st_mtime < _METADATA_CACHE_MAX_AGE:
+                raw_metadata = cache_file.read_bytes()
+                print(f"* Using metadata cached at {cache_file} (use --refresh-metadata to re-fetch)")
+        except OSError:
+            pass    # no cache file (or unreadable) - fetch live
+
+    fetched_live = raw_metadata is None
+    if fetched_live:
+        raw_metadata = _request_metadata(token, url, check_cert)
+
+    md = _loads(raw_metadata)
+    if isinstance(md, dict):
+        # Successful metadata responses are a list; a dict means the API is
+        # reporting a problem (or something unexpected happened)
+        if md.get('error'):
+            raise RuntimeError(f"REDCap API returned an error while fetching metadata: {md['error']}")
+        raise RuntimeError(f"Unexpected metadata response from REDCap API: {md}")
+
+    if fetched_live:
+        # Only cache responses that parsed cleanly and weren't API errors;
+        # write-then-replace keeps a half-written cache file from ever being read
+        try:
+            _METADATA_CACHE_DIR.mkdir(exist_ok=True)
+            temp_file = cache_file.with_suffix('.tmp')
+            temp_file.write_bytes(raw_metadata)
+            temp_file.replace(cache_file)
+        except OSError:
+            pass    # caching is best-effort; a read-only working dir shouldn't kill the run
     return md
 
 def transform_multi_choice_translations(t: dict) -> dict:
@@ -66,85 +154,107 @@ def transform_multi_choice_translations(t: dict) -> dict:
         'Tiếng Việt': {'0': 'Không Đồng Ý', '1': 'Đồng Ý'}}
     '''
     result = dict()
-    for lang in t:
-        for answer_choice in t[lang]:
-            if answer_choice not in result:
-                result[answer_choice] = dict()
-            result[answer_choice][lang] = t[lang][answer_choice]
+    for lang, answers in t.items():
+        for answer_choice, translation in answers.items():
+            result.setdefault(answer_choice, dict())[lang] = translation
     return result
 
-def write_translation_row(name: str, annot: str, w: csv.writer, languages_dict: dict) -> int:
-    '''Parses a REDCap field for translations and writes at least one line to an output file.
-    Returns the number of lines written for this particular field.
+def _parse_field(task: tuple[str, str], native_languages: tuple[str, ...]) -> list[list[str]]:
+    '''Process-pool worker: unpacks one (field_name, field_annotation) task.
     '''
-    #get current @p1000 name (lang, surveytext, errors, etc)
-    start_of_p_field = annot.find("p1000")
-    start_of_data = annot.find("{")
+    return build_translation_rows(task[0], task[1], native_languages)
 
-    #set up row to write to out file 
-    if "p1000lang" in annot[start_of_p_field:start_of_data] or "p1000surveytext" in annot[start_of_p_field:start_of_data]:
-        line_to_write = [name]
-    else:
-        line_to_write = [name + "_" + annot[start_of_p_field:start_of_data]]
+def _csv_escape(cell) -> str:
+    '''Quotes a single CSV cell the same way csv.writer's default dialect would.
+    '''
+    if not isinstance(cell, str):
+        # csv.writer writes None as an empty cell, not the string "None";
+        # a JSON null in a @p1000 payload must stay a missing translation
+        if cell is None:
+            return ''
+        cell = str(cell)
+    if '"' in cell or ',' in cell or '\n' in cell or '\r' in cell:
+        return '"' + cell.replace('"', '""') + '"'
+    return cell
 
-    #determine where current p1000 field ends
-    next_p_field = annot[start_of_data:].find("@p1000")
-    if next_p_field > 0:
-        end_of_data = next_p_field + start_of_data
-    else:
-        end_of_data = annot.rfind("}")+1
+def build_translation_rows(name: str, annot: str, native_languages: tuple[str, ...]) -> list[list[str]]:
+    '''Parses a REDCap field for translations and returns the CSV rows for it
+    (usually one row; one row per answer for multiple-choice fields).
+    'native_languages' is a tuple of native-language column names ('Español', '中文', ...)
+    in CSV column order, precomputed once by the caller.
+    '''
+    rows: list[list[str]] = []
 
-    #parse data
-    to_parse = annot[start_of_data:end_of_data]
-    translation_dict = json.loads(to_parse, strict = False)
+    # Scan the annotation exactly once; each match is one "@p1000<kind>" marker
+    for marker in _P1000_MARKER_RE.finditer(annot):
+        # 'kind' is the current @p1000 name (lang, surveytext, errors, etc)
+        kind = marker.group('kind')
+        block_start = marker.end()
+        if block_start >= len(annot) or annot[block_start] != '{':
+            continue    # marker with no JSON payload
 
-    #write to out file
-    lines_written = 0
+        #set up row to write to out file
+        if kind in ('lang', 'surveytext'):
+            line_to_write = [name]
+        else:
+            line_to_write = [name + "_p1000" + kind]
 
-    for lang in languages_dict.keys():
-        try:
-            line_to_write.append(translation_dict[languages_dict[lang]])
-        except KeyError:
-            line_to_write.append('')
-
-    if "p1000answers" in annot[start_of_p_field:start_of_data]:
-        # Write multiple-choice answers on separate lines
-        # Should immediately follow the REDCap variable for their question prompt
-        # Answers are stored in an embedded dict; parse that dict and write each answer on its own line
-        if all(type(translation_dict[languages_dict[lang]]) == dict for lang in languages_dict.keys()):
-            answers_dict = transform_multi_choice_translations(translation_dict)
-            for answer_raw_value in answers_dict:
-                # Initialize row with "multi_choice_question_variable[value=#]""
-                answers_row = [name + "[value=" + answer_raw_value + "]"]
-                for l in languages_dict.values():
-                    # Answer translations are organized by their respective languages
+        #parse data
+        translation_dict = None
+        block = _P1000_JSON_RE.match(annot, block_start)
+        raw_json = block.group() if block else None
+        if raw_json is not None:
+            try:
+                translation_dict = _loads(raw_json)
+            except ValueError:
+                translation_dict = None
+        if translation_dict is None:
+            # The fast-path regex only tolerates one level of nested braces, so a
+            # stray '}' inside a translated string - or braces nested one level
+            # deeper, like the "JSON-esque code fragments" the README warns about -
+            # truncates or misses the payload. Re-detect the block's end the way the
+            # original parser did: the block runs to the next @p1000 marker (or the
+            # end of the annotation) and closes at the last '}' before that.
+            block_end = annot.find('@p1000', block_start)
+            segment = annot[block_start:block_end if block_end != -1 else len(annot)]
+            raw_json = segment[:segment.rfind('}') + 1]
+            try:
+                translation_dict = _loads(raw_json)
+            except ValueError:
+                print(f"*** Could not parse the @p1000{kind} block on field '{name}' (skipping)")
+                continue
+
+        for native in native_languages:
+            line_to_write.append(translation_dict.get(native, ''))
+
+        if kind == 'answers':
+            # Collect multiple-choice answers on separate lines
+            # Should immediately follow the REDCap variable for their question prompt
+            # Answers are stored in an embedded dict; parse that dict and write each answer on its own line
+            if all(isinstance(translation_dict.get(native), dict) for native in native_languages):
+                # REDCap surveys reuse the same choice list across many fields, so the
+                # pivoted form is cached by the raw JSON text of the block
+                answers_dict = _pivot_cache.get(raw_json)
+                if answers_dict is None:
+                    answers_dict = transform_multi_choice_translations(translation_dict)
+                    _pivot_cache[raw_json] = answers_dict
+                for answer_raw_value, answer_translations in answers_dict.items():
+                    # Row starts with "multi_choice_question_variable[value=#]";
+                    # answer translations are organized by their respective languages
                     # ("中文" instead of "Chinese", for example)
-                    if l in answers_dict[answer_raw_value]:
-                        answers_row.append(answers_dict[answer_raw_value][l])
-                    else:
-                        answers_row.append("")
-                w.writerow(answers_row)
-                lines_written += 1
-    else:
-        # Issue with CSV writer type annotations: https://stackoverflow.com/q/51264355
-        # CSV writer is implemented in C, not in Python, so the writer's type is unavailable.
-        # *Technically* nothing is broken, so... not going to worry about it too much :^)
-        # Could fix by importing _csv instead of csv, but that's not great practice:
-        #   https://til.codeinthehole.com/posts/how-to-typecheck-csv-objects-in-python/
-        #   https://stackoverflow.com/a/12959997
-        w.writerow(line_to_write)
-        lines_written += 1
-
-    #write next row if there is another p1000 field
-    if next_p_field > 0:
-        next_p_field = next_p_field + start_of_data
-        lines_written += write_translation_row(name, annot[next_p_field:], w, languages_dict)
-
-    return lines_written
-
-def write_translations_file(output_path: str, languages_dict: dict[str:str], md: list[dict]) -> int:
+                    rows.append([name + "[value=" + answer_raw_value + "]"]
+                                + [answer_translations.get(l, "") for l in native_languages])
+        else:
+            rows.append(line_to_write)
+
+    return rows
+
+def write_translations_file(output_path: str, languages_dict: dict[str, str], md: list[dict],
+                            excel_compatible: bool = False) -> int:
     '''Iterate through each field in the old REDCap project's metadata `md` and
     write translations to `output_path` as a CSV file.
+    If 'excel_compatible' is True, the file starts with a UTF-8 BOM so Excel
+    detects the encoding; downstream Python readers accept either form.
     Returns the number of lines written across the entire CSV file.
     '''
     output_parent_dir = Path(output_path).parent
@@ -152,33 +262,53 @@ def write_translations_file(output_path: str, languages_dict: dict[str:str], md:
         output_parent_dir.mkdir()
         print(f"* Created directory: {output_parent_dir}")
     
-    lines_written = 0
-
-    with open(output_path, 'w',  newline='', encoding='utf-8-sig') as out_file:
-        csv_header_row = ["Field"] + [k for k in languages_dict.keys()]
-        csv_writer = csv.writer(out_file)
-        csv_writer.writerow(csv_header_row)
-        for field in md:
-            field_name = field["field_name"]
-            field_annotation = field["field_annotation"]
-            # print(f"FIELD NAME ({type(field_name)}): {field_name}\n\tFIELD ANNOTATION ({type(field_annotation)}): {field_annotation}")
-            if "@p1000" in field_annotation:
-                lines_written += write_translation_row(field_name, field_annotation, csv_writer, languages_dict)
-    return lines_written
+    # Split the language mapping into parallel tuples once; build_translation_rows
+    # iterates them per block and per answer, so dict views would be rebuilt constantly
+    english_languages = tuple(languages_dict.keys())
+    native_languages = tuple(languages_dict.values())
+
+    # Accumulate every row first and format the whole file in memory,
+    # instead of paying a writer call per field/answer.
+    # No '@p1000 in ...' pre-check on the annotations: the regex scan in
+    # build_translation_rows simply yields no rows for fields without
+    # translations, so guarding would just walk every annotation twice
+    rows: list[list[str]] = [["Field", *english_languages]]
+    tasks = [(field["field_name"], field["field_annotation"]) for field in md]
+    if len(tasks) >= _PARALLEL_FIELD_THRESHOLD:
+        # Per-field parsing shares no state, so large projects fan out across cores
+        with ProcessPoolExecutor() as executor:
+            rows_per_field = executor.map(partial(_parse_field, native_languages=native_languages),
+                                          tasks, chunksize=64)
+            rows.extend(chain.from_iterable(rows_per_field))
+    else:
+        for field_name, field_annotation in tasks:
+            rows.extend(build_translation_rows(field_name, field_annotation, native_languages))
+
+    # Format every row into one buffer ('\r\n' matches csv.writer's default
+    # lineterminator) and cross into the file object exactly once
+    buf = io.StringIO()
+    for row in rows:
+        buf.write(','.join([_csv_escape(cell) for cell in row]))
+        buf.write('\r\n')
+    with open(output_path, 'w', newline='', encoding='utf-8-sig' if excel_compatible else 'utf-8') as out_file:
+        out_file.write(buf.getvalue())
+    return len(rows) - 1    # don't count the header row
 
 def create_translations_file(secrets_path: str,
                              output_path: str,
-                             supported_languages_dict: dict[str:str],
-                             check_certificate: bool) -> None:
+                             supported_languages_dict: dict[str, str],
+                             check_certificate: bool,
+                             excel_compatible: bool = False,
+                             refresh_metadata: bool = False) -> None:
     # supported_languages_dict = {'language_in_english':'language_in_native_language'} (example: {'Spanish':'Español'})
 
     API_TOKEN,API_URL = load_secrets(secrets_path)
     print(f"Loaded secrets file: {secrets_path}")
 
-    old_proj_metadata = get_metadata(API_TOKEN, API_URL, check_certificate)
+    old_proj_metadata = get_metadata(API_TOKEN, API_URL, check_certificate, refresh_metadata)
     print("Got old REDCap project metadata")
 
-    num_lines_written = write_translations_file(output_path, supported_languages_dict, old_proj_metadata)
+    num_lines_written = write_translations_file(output_path, supported_languages_dict, old_proj_metadata, excel_compatible)
     
     print(f"Wrote {num_lines_written} translated REDCap fields to: {output_path}")
     return
@@ -1,6 +1,9 @@
+from __future__ import annotations
+
 import csv
 import argparse
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 
 import extract_em_translations
@@ -15,10 +18,28 @@ parser.add_argument("-l", "--language", required=True, help="Language to transla
 parser.add_argument("-o", "--output-file", help="Path to a new JSON file that will contain translations from the old external module.")
 parser.add_argument("-q", "--escaped-double-quotes", action="store_true", help="If provided, double quote characters will be exported with backslash escape characters (\\\"). If absent, double quotes are replaced with single quotes (')")
 parser.add_argument("--no-check-certificate", action="store_true", help="If provided, disables certificate checking when using an API call to retrieve metadata from the old REDCap project.")
+parser.add_argument("--excel-compatible", action="store_true", help="If provided, the translations CSV is written with a UTF-8 byte order mark so Excel detects its encoding. If absent, plain UTF-8 is written.")
+parser.add_argument("--refresh-metadata", action="store_true", help="If provided, re-fetches the old REDCap project's metadata from the API even if a cached copy from the last 24 hours exists.")
 
 ################################################################
 ################################################################
 
+@lru_cache(maxsize=None)
+def _load_languages_cached(csv_path: str) -> tuple[tuple[str, str, str], ...]:
+    '''Reads and parses the language CSV exactly once per path; repeat calls hit the cache.
+    Returns a tuple of (english, shortcode, native) tuples, one per row in the file.
+    '''
+    with open(csv_path, 'r', encoding='utf-8-sig') as language_csv:
+        return tuple((row[0], row[1], row[2]) for row in csv.reader(language_csv))
+
+@lru_cache(maxsize=None)
+def _supported_languages(csv_path: str) -> frozenset[str]:
+    '''The set of acceptable user inputs for a language: every English name plus
+    every 2-character shortcode found in the file at 'csv_path'.
+    '''
+    return frozenset(value for english, shortcode, _ in _load_languages_cached(csv_path)
+                     for value in (english, shortcode))
+
 def load_languages(csv_path: str, english_to_native: bool = False, english_to_shortcode: bool = False) -> dict:
     '''Creates a dictionary that maps language strings to alternative ways of labeling languages.
     If 'english_to_native' is True, returns a dict such that:
@@ -28,13 +49,11 @@ def load_languages(csv_path: str, english_to_native: bool = False, english_to_sh
     Of course, the actual values are dependent on the contents of the file located at 'csv_path'.
     '''
     result = dict()
-    with open(csv_path, 'r', encoding='utf-8-sig') as language_csv:
-        w = csv.reader(language_csv)
-        for row in w:
-            if english_to_native:
-                result[row[0]] = row[2]
-            elif english_to_shortcode:
-                result[row[0]] = row[1]
+    for english, shortcode, native in _load_languages_cached(csv_path):
+        if english_to_native:
+            result[english] = native
+        elif english_to_shortcode:
+            result[english] = shortcode
     return result
 
 def sanitize_language(l: str) -> str:
@@ -48,14 +67,13 @@ def sanitize_language(l: str) -> str:
         # Shortcodes should be all lowercase ("en", "es", etc.)
         result = l.lower()
     
-    languages_to_shortcodes = load_languages(LANGUAGES_CSV_FILE, english_to_shortcode=True)
-    actual_supported_languages = [k for k in languages_to_shortcodes.keys()] + [v for v in languages_to_shortcodes.values()]
+    actual_supported_languages = _supported_languages(LANGUAGES_CSV_FILE)
     if result not in actual_supported_languages:
-        raise ValueError(f"Unknown language '{result}'; language must be one of:\n\t{actual_supported_languages}")
+        raise ValueError(f"Unknown language '{result}'; language must be one of:\n\t{sorted(actual_supported_languages)}")
 
     return result
 
-def get_cmd_line_inputs(inp: argparse.Namespace) -> tuple[str, str, str, str, bool, bool]:
+def get_cmd_line_inputs(inp: argparse.Namespace) -> tuple[str, str, str, str, bool, bool, bool, bool]:
     if not inp.json_template.endswith('.json'):
         raise ValueError(f"REDCap Multi Language Management file must have '.json' extension: {inp.json_template}")
     
@@ -77,20 +95,22 @@ def get_cmd_line_inputs(inp: argparse.Namespace) -> tuple[str, str, str, str, bo
             translations_file,
             filled_json_output_file,
             not inp.escaped_double_quotes,
-            not inp.no_check_certificate)
+            not inp.no_check_certificate,
+            inp.excel_compatible,
+            inp.refresh_metadata)
 
 ################################################################
 ################################################################
 
 if __name__ == '__main__':
-    redcap_mlm_template_json, language, translations_file, filled_json_output_file, replace_single_quotes_from_em_translations, check_certificate = get_cmd_line_inputs(parser.parse_args())
+    redcap_mlm_template_json, language, translations_file, filled_json_output_file, replace_single_quotes_from_em_translations, check_certificate, excel_compatible, refresh_metadata = get_cmd_line_inputs(parser.parse_args())
 
     # First, create the monolithic translations file to extract translations
     # from an old REDCap project's Multilingual external module
     print("(1/2) Extracting translations from old REDCap project....")
     extract_em_translations.create_translations_file(SECRETS_FILE, translations_file,
                                                      load_languages(LANGUAGES_CSV_FILE, english_to_native=True),
-                                                     check_certificate)
+                                                     check_certificate, excel_compatible, refresh_metadata)
     print()
     # Next, fill out a template JSON file from a new REDCap project's Multi Language Manager
     # with translations from the translations file
@@ -1,14 +1,34 @@
+from __future__ import annotations
+
+import copy
 import csv
 import json
+import sys
 
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+try:
+    import pyarrow as pa  # type: ignore[import-not-found, import-untyped]
+    from pyarrow import csv as pacsv  # type: ignore[import-not-found, import-untyped]
+except ImportError:
+    pa = None  # type: ignore[assignment]
+
 ################################################################
 ################################################################
 
 class TranslatedField:
     '''Contains data for a single translated REDCap field (one line in the CSV).
     '''
+    # Fixed attribute set: no per-instance __dict__, which roughly halves the
+    # memory of the translations map and speeds attribute reads in hot loops
+    __slots__ = ('field_name', 'translations', '_translations_quoted', 'translated', 'is_incomplete')
+
     def __init__(self, field: str, csv_row: list[str], language_order_key: list[str]):
         # language_order_key: list of languages as they appear in the first row of the translations CSV
         # i.e. ['English', 'Spanish', ... ]
@@ -16,52 +36,81 @@ class TranslatedField:
         # Size in memory could be further reduced by removing the TranslatedField.field_name attribute, but there
         # isn't a need for space optimization at the moment and the attribute helps with debugging.
         self.field_name: str                = field     # REDCap variable name
-        self.translations: dict[str:str]    = dict()
         self.translated: bool               = False     # Has this translation been applied to the new JSON?
-        self.is_incomplete: bool            = False     # Does this translation have any missing languages?
-        for lang,text in zip(language_order_key, csv_row):
-            self.translations[lang] = text
-            # The CSV will have an empty cell if a given translation is missing
-            if text == "":
-                self.is_incomplete = True
+
+        # Transform each cell once at load time so get_translation is a plain
+        # dict lookup no matter how many sites the translation is applied to.
+        # REDCap appears to replace '@' chars with '___' in field data, breaking email addresses.
+        self.translations: dict[str, str] = {lang: text.replace('___', '@').strip()
+                                             for lang, text in zip(language_order_key, csv_row)}
+        # JSON files use double quotes by design, so any quotes in JSON values need to be escaped, and
+        # the characters \" appear in values where only double quotes should appear.
+        # REDCap doesn't properly parse these escaped quotes, so any double quotes used in, for example,
+        # HTML styling ( <div style="background-color: #e6ffff;" ) would not render properly (if at all).
+        self._translations_quoted: dict[str, str] = {lang: text.replace('"', "'")
+                                                     for lang, text in self.translations.items()}
+        # The CSV will have an empty cell if a given translation is missing
+        # ('' in list is a single C-level membership scan)
+        self.is_incomplete: bool = "" in csv_row
 
     def __repr__(self):
         return f"TranslatedField(field_name={self.field_name},translations={str(self.translations)},translated={self.translated},is_incomplete={self.is_incomplete})"
 
-    def get_translation(self, l: str, available_languages: dict, replace_quotes: bool = False) -> str:
+    def get_translation(self, l: str, available_languages: dict[str, str], replace_quotes: bool = False) -> str:
         '''Returns a translation of this field in language `l` and sets this field's 'translated' flag to True.
         `l` may be either a 2-character shortcode or a language in English (i.e. "Spanish" or "es", not "Español").
-        Will modify the translation slightly, replacing '___' substrings with '@' and may optionally
-        replace escaped double quotes (\") with single quotes.
+        The returned text has '___' substrings replaced with '@' and, if 'replace_quotes' is True,
+        double quotes replaced with single quotes (both precomputed at load time).
         '''
         # This class stores languages according their original name, so:
         #       self.translations['Spanish']    # (returns a string)
         #       self.translations['es']         # KeyError
         # Need the `available_languages` dict to allow lookups via shortcode.
-        t: str = self.translations[available_languages[l]] if l not in self.translations else self.translations[l]
-
-        # REDCap appears to replace '@' chars with '___' in field data, breaking email addresses.
-        t = t.replace('___', '@')
-
-        # JSON files use double quotes by design, so any quotes in JSON values need to be escaped, and
-        # the characters \" appear in values where only double quotes should appear.
-        # REDCap doesn't properly parse these escaped quotes, so any double quotes used in, for example,
-        # HTML styling ( <div style="background-color: #e6ffff;" ) would not render properly (if at all).
-        if replace_quotes:
-            t = t.replace('"', "'")
-        
+        key = l if l in self.translations else available_languages[l]
         self.translated = True
-        return t.strip()
+        return (self._translations_quoted if replace_quotes else self.translations)[key]
 
 ################################################################
 ################################################################
 
-def load_csv(csv_path: str) -> dict[TranslatedField]:
-    result: dict[TranslatedField] = dict()
+def load_csv(csv_path: str) -> dict[str, TranslatedField]:
+    '''Reads the translations CSV into a dict of field name -> TranslatedField.
+    Uses pyarrow's multithreaded C tokenizer when installed; the stdlib csv module
+    is the fallback (and handles files with inconsistent row lengths, which Arrow rejects).
+    '''
+    if pa is not None:
+        try:
+            return _load_csv_arrow(csv_path)
+        except pa.ArrowInvalid as e:
+            print(f"* pyarrow could not parse {csv_path} ({e}); retrying with the stdlib csv reader")
+    return _load_csv_stdlib(csv_path)
+
+def _load_csv_arrow(csv_path: str) -> dict[str, TranslatedField]:
+    # Read the header with the stdlib first so every column can be pinned to
+    # string; Arrow would otherwise type-infer numeric-looking cells
+    with open(csv_path, "r", encoding='utf-8-sig', newline='') as csv_file:
+        header = next(csv.reader(csv_file))
+
+    table = pacsv.read_csv(csv_path,
+                           read_options=pacsv.ReadOptions(encoding='utf-8-sig'),
+                           convert_options=pacsv.ConvertOptions(column_types={column: pa.string() for column in header}))
+    # Interned names/languages make the heavy dict traffic in apply_translations
+    # compare pointers instead of characters
+    detected_languages = [sys.intern(language) for language in header[1:]]
+    result: dict[str, TranslatedField] = dict()
+    for name, *cells in zip(*[column.to_pylist() for column in table.columns]):
+        name = sys.intern(name)
+        result[name] = TranslatedField(name, ['' if cell is None else cell for cell in cells], detected_languages)
+    return result
+
+def _load_csv_stdlib(csv_path: str) -> dict[str, TranslatedField]:
+    result: dict[str, TranslatedField] = dict()
     # A bit of redudancy: result['example_field_name'] is a TranslatedField object, so this silliness is valid:
     #   result['example_field_name'].field_name == 'example_field_name'     # True
 
-    with open(csv_path, "r", encoding='utf-8-sig') as csv_file:
+    # 1 MiB buffer amortizes read syscalls over many rows; newline='' is the
+    # csv-module-recommended setting and skips universal-newline retranslation
+    with open(csv_path, "r", encoding='utf-8-sig', buffering=1<<20, newline='') as csv_file:
         current_line = 0
         expected_row_length = 0
         detected_languages = []
@@ -72,42 +121,48 @@ def load_csv(csv_path: str) -> dict[TranslatedField]:
             if current_line == 1:
                 # Detect some initial info from the first line in the CSV
                 expected_row_length = len(row)
-                detected_languages = row[1:]
+                detected_languages = [sys.intern(language) for language in row[1:]]
                 ###print(f"* Found {expected_row_length-1} language(s): {', '.join(detected_languages)}")
                 continue
             if len(row) == expected_row_length:
-                result[row[0]] = TranslatedField(row[0], row[1:], detected_languages)
+                field_name = sys.intern(row[0])
+                result[field_name] = TranslatedField(field_name, row[1:], detected_languages)
             else:
+                # Diagnostics only; nothing here runs for well-formed rows, and the
+                # O(len(row)) empty-cell scan happens only when the message is emitted
                 problematic_variable = ""
                 if len(row) > 0:
                     problematic_variable += "(Field: '" + row[0] + "') "
-                print(f"*** Missing {row.count('')} translation(s) at line {current_line} {problematic_variable}(skipping)")
+                empty_cells = sum(1 for cell in row if not cell)
+                print(f"*** Missing {empty_cells} translation(s) at line {current_line} {problematic_variable}(skipping)")
 
     return result
 
 def load_json(json_path: str) -> dict:
-    result = dict()
-    with open(json_path, encoding='utf-8-sig') as json_file:
-        result = json.load(json_file)
-    return result
+    raw = Path(json_path).read_bytes()
+    # MLM exports sometimes carry a UTF-8 BOM, which JSON parsers reject
+    if raw.startswith(b'\xef\xbb\xbf'):
+        raw = raw[3:]
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
 
-def apply_translations(translations: list[TranslatedField],
-                       original_json: dict,
-                       desired_language: str,
-                       available_languages: dict,
-                       replace_quotes: bool = False) -> int:
-    '''Populates empty translation fields in `original_json` with translations to `desired_language`.
-    Returns the number of translations applied.
+def _collect_sites(original_json: dict,
+                   lookup: dict[str, str],
+                   enum_entries: dict[str, dict[str, str]],
+                   note_entries: dict[str, str]) -> list[tuple[dict, str, str]]:
+    '''Walks the MLM template once and returns every location that should receive a
+    translation as a (target_dict, key, csv_entry_name) tuple. All the shape detection
+    (which branches a record has, which synthetic CSV entry each one maps to) happens
+    here, so applying the translations afterwards is a flat loop of dict writes.
     '''
-    successful_translations: list[int] = []
-
-    for category in original_json:
-        if type(original_json[category]) == list and len(original_json[category]) > 0:
-            ###print(f"* Applying translations to REDCap category '{category}'...")
-            this_categorys_successful_translations = 0
-            redcap_fields_missing_translations = []
-            for text_string_index in range(len(original_json[category])):
-                this_redcap_field = original_json[category][text_string_index]
+    sites: list[tuple[dict, str, str]] = []
+
+    for category, entries in original_json.items():
+        if isinstance(entries, list) and entries:
+            ###print(f"* Collecting translation sites in REDCap category '{category}'...")
+            redcap_fields_missing_translations = set()  # One field can miss via several branches; dedupe
+            for this_redcap_field in entries:
                 # Records in the original JSON categories can look like this:
                 #
                 # { "id": "THE_ID_ALSO_IN_THE_CSV",
@@ -131,50 +186,97 @@ def apply_translations(translations: list[TranslatedField],
                 # }
                 if 'id' in this_redcap_field:
                     field_name = this_redcap_field['id']
-                    if field_name in translations:
+                    if field_name in lookup:
                         if 'translation' in this_redcap_field and this_redcap_field['translation'] == '':
                             #print(f"Field name: {field_name} | {this_redcap_field}")
-                            this_redcap_field['translation'] = translations[field_name].get_translation(desired_language, available_languages, replace_quotes)
-                            this_categorys_successful_translations += 1
-                        
+                            sites.append((this_redcap_field, 'translation', field_name))
+
                         elif 'label' in this_redcap_field and \
-                        type(this_redcap_field['label']) == dict and \
+                        isinstance(this_redcap_field['label'], dict) and \
                         'translation' in this_redcap_field['label'] and \
                         this_redcap_field['label']['translation'] == '':
                             #print(f"Field name (translation in 'label'): {field_name} | {this_redcap_field}")
-                            this_redcap_field['label']['translation'] = translations[field_name].get_translation(desired_language, available_languages, replace_quotes)
-                            this_categorys_successful_translations += 1
-                        
+                            sites.append((this_redcap_field['label'], 'translation', field_name))
+
                         if 'enum' in this_redcap_field and \
-                        type(this_redcap_field['enum']) == list:
-                            # Apply multiple-choice translations
+                        isinstance(this_redcap_field['enum'], list):
+                            # Multiple-choice translations
                             #print(f"Field name (multiple choices in 'enum'): {field_name} | via {this_redcap_field}")
-                            multiple_choice_answers_list = this_redcap_field['enum']
-                            for answer_index in range(len(multiple_choice_answers_list)):
-                                if multiple_choice_answers_list[answer_index]['translation'] == '':
-                                    csv_entry = this_redcap_field['id'] + "[value=" + str(multiple_choice_answers_list[answer_index]['id']) + "]"
-                                    if csv_entry in translations:
-                                        this_redcap_field['enum'][answer_index]['translation'] = translations[csv_entry].get_translation(desired_language, available_languages, replace_quotes)
-                                        this_categorys_successful_translations += 1
-                        
+                            field_enum_entries = enum_entries.get(field_name)
+                            if field_enum_entries:
+                                for answer in this_redcap_field['enum']:
+                                    if answer['translation'] == '':
+                                        csv_entry = field_enum_entries.get(str(answer['id']))
+                                        if csv_entry is not None:
+                                            sites.append((answer, 'translation', csv_entry))
+
                         if 'note' in this_redcap_field and \
                         'translation' in this_redcap_field['note'] and \
                         this_redcap_field['note']['translation'] == '':
-                            # Apply field note translations
-                            csv_entry = field_name + "_p1000notes"
-                            if csv_entry in translations:
+                            # Field note translations
+                            csv_entry = note_entries.get(field_name)
+                            if csv_entry is not None:
                                 # print(f"* {field_name} - field note in CSV: {csv_entry} | via {this_redcap_field}")
-                                this_redcap_field['note']['translation'] = translations[csv_entry].get_translation(desired_language, available_languages, replace_quotes)
-                                this_categorys_successful_translations += 1
+                                sites.append((this_redcap_field['note'], 'translation', csv_entry))
                     else:
                         # Found a REDCap field with no corresponding translation in the CSV
-                        redcap_fields_missing_translations.append(field_name)
+                        redcap_fields_missing_translations.add(field_name)
                 else:
                     # All REDCap fields in the JSON should have an 'id' field; otherwise, JSON has probably been tampered with
                     print("[REDCap MLM template JSON] Found REDCap field without an 'id': " + str(this_redcap_field))
-            successful_translations.append(this_categorys_successful_translations)
             #print(f"{category} missing translations for these fields: {redcap_fields_missing_translations}")
-    return sum(successful_translations)
+
+    return sites
+
+def apply_translations(translations: dict[str, TranslatedField],
+                       original_json: dict,
+                       desired_language: str,
+                       available_languages: dict[str, str],
+                       replace_quotes: bool = False) -> int:
+    '''Populates empty translation fields in `original_json` with translations to `desired_language`.
+    Returns the number of translations applied.
+    '''
+    # The language and quote handling are fixed for the whole call, so resolve them
+    # once and flatten every field's final string into a plain dict; each site below
+    # then costs one dict probe instead of a method call with its own key resolution.
+    if translations:
+        sample = next(iter(translations.values()))
+        real_lang = desired_language if desired_language in sample.translations else available_languages[desired_language]
+        if replace_quotes:
+            lookup = {name: tf._translations_quoted[real_lang] for name, tf in translations.items()}
+        else:
+            lookup = {name: tf.translations[real_lang] for name, tf in translations.items()}
+    else:
+        lookup = {}
+    applied_csv_entries: set[str] = set()    # Names of every CSV entry actually applied
+
+    # Index the synthetic CSV entry names up front so the structure walk never
+    # rebuilds "field[value=N]" / "field_p1000notes" strings per answer
+    enum_entries: dict[str, dict[str, str]] = {}     # field_name -> {str(answer id) -> full CSV entry name}
+    note_entries: dict[str, str] = {}     # field_name -> full CSV entry name
+    for entry in lookup:
+        if entry.endswith(']'):
+            base_name, bracket, answer_value = entry[:-1].partition('[value=')
+            if bracket:
+                enum_entries.setdefault(base_name, {})[answer_value] = entry
+        elif entry.endswith('_p1000notes'):
+            note_entries[entry[:-len('_p1000notes')]] = entry
+
+    # Two phases: walk the template once to find every write-site, then apply
+    # in a flat loop with no shape branching left in it
+    # (empty-string translations are legitimate values, so test against None)
+    total_translations = 0
+    for target, key, csv_entry in _collect_sites(original_json, lookup, enum_entries, note_entries):
+        translation = lookup.get(csv_entry)
+        if translation is not None:
+            target[key] = translation
+            applied_csv_entries.add(csv_entry)
+            total_translations += 1
+
+    # The per-field 'translated' flags are debug bookkeeping; set them in one pass
+    for csv_entry in applied_csv_entries:
+        translations[csv_entry].translated = True
+    return total_translations
 
 def write_new_json_file(filled_json: dict, new_json_file: str) -> None:
     output_parent_dir = Path(new_json_file).parent
@@ -182,21 +284,101 @@ def write_new_json_file(filled_json: dict, new_json_file: str) -> None:
         output_parent_dir.mkdir()
         print(f"* Created directory: {output_parent_dir}")
 
-    with open(new_json_file, "w+", encoding='utf-8-sig') as outfile:
-        json.dump(filled_json, outfile, ensure_ascii=False, indent=2)
+    if orjson is not None:
+        # orjson always emits UTF-8 and never escapes non-ASCII,
+        # matching the stdlib call below
+        serialized = orjson.dumps(filled_json, option=orjson.OPT_INDENT_2)
+    else:
+        serialized = json.dumps(filled_json, ensure_ascii=False, indent=2).encode('utf-8')
+
+    # Re-runs over the same template and CSV are common; when the result is
+    # byte-identical to what's already on disk (typical when pointing -o at a
+    # previous output), skip the write and keep the file's timestamp honest
+    out_path = Path(new_json_file)
+    try:
+        if out_path.stat().st_size == len(serialized) and out_path.read_bytes() == serialized:
+            print(f"* Output is unchanged; not rewriting {new_json_file}")
+            return
+    except OSError:
+        pass    # no previous file - just write it
+
+    out_path.write_bytes(serialized)
+    return
+
+def _with_reverse_mapping(supported_languages_dict: dict[str, str]) -> dict[str, str]:
+    '''Returns a new dict holding 'supported_languages_dict' plus its inverse, so both
+    full language names and shortcodes resolve. Never mutates the caller's dict.
+    '''
+    # Interned to match the keys produced by load_csv
+    supported_languages_dict = {sys.intern(k): sys.intern(v) for k, v in supported_languages_dict.items()}
+    return {**supported_languages_dict,
+            **{v: k for k, v in supported_languages_dict.items()}}
+
+################################################################
+################################################################
+
+# Read-only state shared by fill_all_languages workers,
+# populated once per worker process by _init_language_worker
+_worker_state: dict = {}
+
+def _init_language_worker(translations, template, supported_languages_dict, replace_quotes, output_dir):
+    _worker_state.update(translations=translations,
+                         template=template,
+                         supported_languages_dict=supported_languages_dict,
+                         replace_quotes=replace_quotes,
+                         output_dir=output_dir)
+
+def _fill_one_language(language: str) -> tuple[str, int, str]:
+    '''Process-pool worker: translates the shared template to one language.
+    apply_translations mutates the JSON in place, so each call works on its own
+    deep copy of the pristine template.
+    '''
+    filled_json = copy.deepcopy(_worker_state['template'])
+    num_tls = apply_translations(_worker_state['translations'], filled_json, language,
+                                 _worker_state['supported_languages_dict'], _worker_state['replace_quotes'])
+    final_json_path = str(Path(_worker_state['output_dir']) / f"{language.lower()}-output.json")
+    write_new_json_file(filled_json, final_json_path)
+    return (language, num_tls, final_json_path)
+
+def fill_all_languages(em_translations_csv_path: str,
+                       redcap_mlm_empty_json_path: str,
+                       languages: list[str],
+                       supported_languages_dict: dict[str, str],
+                       replace_quotes: bool,
+                       output_dir: str) -> None:
+    '''Translates one MLM template to every language in 'languages', writing
+    '<language>-output.json' files under 'output_dir'. The CSV and template are
+    loaded once and the per-language apply/write work fans out across processes.
+    '''
+    supported_languages_dict = _with_reverse_mapping(supported_languages_dict)
+
+    translations: dict[str, TranslatedField] = load_csv(em_translations_csv_path)
+    print("Loaded translations")
+
+    loaded_json_template = load_json(redcap_mlm_empty_json_path)
+    print(f"Loaded template JSON file: {redcap_mlm_empty_json_path}")
+
+    # Create the output directory here rather than letting the workers race to do it
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+    with ProcessPoolExecutor(initializer=_init_language_worker,
+                             initargs=(translations, loaded_json_template,
+                                       supported_languages_dict, replace_quotes, output_dir)) as executor:
+        for language, num_tls, final_json_path in executor.map(_fill_one_language, languages):
+            print(f"[{language}] Wrote {num_tls} translations to: {final_json_path}")
     return
 
 def fill_new_translation_json(em_translations_csv_path: str,
                               redcap_mlm_empty_json_path: str,
                               selected_language: str,
-                              supported_languages_dict: dict,
+                              supported_languages_dict: dict[str, str],
                               replace_quotes: bool,
                               final_json_path: str) -> None:
     # supported_languages_dict = {'language_in_english':'2-char_shortcode'} (or vice-versa; example: {'Spanish':'es'})
-    # Add a reverse mapping to support accepting either full language names *or* shortcodes as valid user input
-    supported_languages_dict |= dict((supported_languages_dict[i], i) for i in supported_languages_dict)
+    # Accept either full language names *or* shortcodes as valid user input
+    supported_languages_dict = _with_reverse_mapping(supported_languages_dict)
 
-    translations: dict[TranslatedField] = load_csv(em_translations_csv_path)
+    translations: dict[str, TranslatedField] = load_csv(em_translations_csv_path)
     print("Loaded translations")
 
     loaded_json_template = load_json(redcap_mlm_empty_json_path)